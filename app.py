@@ -1,26 +1,138 @@
 import os
+import json
+import logging
+import hashlib
 import tempfile
+import mimetypes
 import asyncio
-from fastapi import FastAPI, UploadFile, HTTPException
+import time
+import aiofiles
+import aiofiles.os
+import anyio
+import orjson
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Protocol
+from fastapi import Depends, FastAPI, UploadFile, HTTPException
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 import google.genai as genai
-from dotenv import load_dotenv
-from browser_use import Agent
+from pydantic import SecretStr
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from browser_use import Agent, BrowserProfile, BrowserSession
 from langchain_openai import ChatOpenAI
-import time
 
-# Load environment variables
-load_dotenv()
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class Settings(BaseSettings):
+    """Configuration read from the environment, falling back to .env"""
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    google_api_key: Optional[SecretStr] = None
+    openai_api_key: Optional[SecretStr] = None
+    redis_url: Optional[str] = None
+    # Browser sessions are pre-launched per worker and replaced after each
+    # task; this also caps that worker's Chromium instances
+    browser_pool_size: int = 4
+
+@lru_cache(maxsize=None)
+def get_settings():
+    return Settings()
+
+@lru_cache(maxsize=None)
+def get_client():
+    """Gemini client, created once per worker process"""
+    api_key = get_settings().google_api_key
+    return genai.Client(api_key=api_key.get_secret_value())
+
+GEMINI_MODEL = "gemini-2.5-pro-preview-05-06"
+
+PROMPT = (
+    "Analyze this video and provide a detailed, step-by-step "
+    "description of all actions performed. Focus on exact "
+    "timestamps, UI elements, and user interactions. Format the "
+    "output as a series of browser automation instructions that "
+    "can be used to replicate these actions. Include specific "
+    "details about elements to click, text to enter, and any "
+    "navigation steps."
+)
+PROMPT_SHA = hashlib.sha256(PROMPT.encode()).digest()
+
+@lru_cache(maxsize=None)
+def get_llm():
+    """Browser agent LLM, shared so requests reuse its connection pool"""
+    return ChatOpenAI(
+        model="gpt-4o",
+        api_key=get_settings().openai_api_key,
+        max_retries=2,
+        timeout=60
+    )
+
+CACHE_TTL = 24 * 60 * 60  # 24 hours
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+MAX_UPLOAD_BYTES = 2 << 30  # 2 GiB, the Gemini Files API limit
+# Part content types that say nothing about the payload
+GENERIC_CONTENT_TYPES = {None, "", "application/octet-stream"}
+# Allowance for the multipart boundaries and part headers around the video
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + (1 << 20)
 
-# Configure Gemini API
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY environment variable is not set")
+FILE_PROCESSING_TIMEOUT = 600  # 10 minutes
+FILE_POLL_MAX_DELAY = 30
 
-client = genai.Client(api_key=GOOGLE_API_KEY)
+BLOCKING_IO_THREADS = 32
+
+BROWSER_RETRY_MAX_DELAY = 60
+
+# Ready sessions; slots being launched or retried live in browser_tasks
+browser_pool: asyncio.Queue = asyncio.Queue()
+browser_tasks: set = set()
+browser_slots_failing = 0
+browser_pool_error: Optional[str] = None
+browser_pool_closing = False
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+class UploadSizeLimitMiddleware:
+    """Refuse an oversized upload from its Content-Length header
+
+    Starlette spools the whole multipart body before a handler runs, so
+    this is the only point where the transfer itself can be avoided. A
+    plain ASGI middleware passes every other request, including the
+    NDJSON stream, straight through.
+    """
+
+    def __init__(self, app, path, max_bytes):
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == self.path:
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > self.max_bytes:
+                        response = ORJSONResponse(
+                            status_code=413,
+                            content={"detail": "Video is too large"}
+                        )
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+
+# Added before CORS so that CORS wraps it and the 413 stays readable
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    path="/process-video",
+    max_bytes=MAX_REQUEST_BYTES
+)
 
 # Add CORS middleware
 app.add_middleware(
@@ -31,185 +143,608 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def wait_for_file_processing(file):
+class CacheBackend(Protocol):
+    """Storage used by LLMCache"""
+
+    async def get(self, key: str) -> Optional[dict]:
+        ...
+
+    async def set(self, key: str, value: dict) -> None:
+        ...
+
+
+class InMemoryCacheBackend:
+    """Process-local LRU cache backend with a per-entry TTL"""
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=1024):
+        self._store: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._ttl = ttl
+        self._max_entries = max_entries
+
+    async def get(self, key):
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._store[key]
+            return None
+        self._store.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        self._store[key] = (time.monotonic() + self._ttl, value)
+        self._store.move_to_end(key)
+        while len(self._store) > self._max_entries:
+            self._store.popitem(last=False)
+
+
+class RedisCacheBackend:
+    """Redis cache backend with a per-entry TTL"""
+
+    def __init__(self, url, ttl=CACHE_TTL):
+        import redis.asyncio
+
+        self._redis = redis.asyncio.Redis.from_url(url)
+        self._ttl = ttl
+
+    async def get(self, key):
+        raw = await self._redis.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key, value):
+        await self._redis.set(key, json.dumps(value), ex=self._ttl)
+
+
+class LLMCache:
+    """Exact-match cache keyed by video content, model and prompt"""
+
+    def __init__(self, backend: CacheBackend, namespace: str):
+        self.backend = backend
+        self.namespace = namespace
+
+    def make_key(self, video_digest, model, prompt_digest):
+        key = hashlib.sha256(video_digest + prompt_digest + model.encode())
+        return f"{self.namespace}:{key.hexdigest()}"
+
+    async def get(self, key):
+        try:
+            return await self.backend.get(key)
+        except Exception as e:
+            # A broken cache should never fail the request
+            logger.warning("Cache lookup failed: %s", e)
+            return None
+
+    async def set(self, key, value):
+        try:
+            await self.backend.set(key, value)
+        except Exception as e:
+            logger.warning("Cache store failed: %s", e)
+
+
+@lru_cache(maxsize=None)
+def get_cache_backend():
+    """Use Redis when REDIS_URL is set, otherwise an in-process dict"""
+    redis_url = get_settings().redis_url
+    if redis_url:
+        return RedisCacheBackend(redis_url)
+    logger.warning(
+        "REDIS_URL is not set; cached descriptions are not shared between "
+        "workers"
+    )
+    return InMemoryCacheBackend()
+
+@lru_cache(maxsize=None)
+def get_description_cache():
+    return LLMCache(get_cache_backend(), namespace="description")
+
+async def wait_for_file_processing(file):
     """Wait for file to be in ACTIVE state"""
-    max_retries = 120  # Increased to 120 retries (10 minutes)
-    retry_delay = 5  # 5 seconds between retries
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + FILE_PROCESSING_TIMEOUT
+    delay = 0.5  # Backs off to FILE_POLL_MAX_DELAY between polls
     
-    print("\n=== Starting File Processing Check ===")
-    print(f"File object: {file}")
-    print(f"File type: {type(file)}")
-    print(f"File attributes: {dir(file)}")
+    logger.info("=== Starting File Processing Check ===")
+    logger.debug("File object: %s", file)
     
     # Check if file has a name attribute
     if not hasattr(file, 'name'):
-        print("Error: File object has no 'name' attribute")
+        logger.error("File object has no 'name' attribute")
         return False
         
     # Get initial file status
     try:
-        file_status = client.files.get(name=file.name)
-        print(f"Initial file status: {file_status}")
-        print(f"File status type: {type(file_status)}")
-        print(f"File status attributes: {dir(file_status)}")
+        file_status = await asyncio.to_thread(
+            get_client().files.get, name=file.name
+        )
+        logger.debug("Initial file status: %s", file_status)
         
         # Check if there's any error in the initial status
         if hasattr(file_status, 'error') and file_status.error:
-            print(f"Error in file status: {file_status.error}")
+            logger.error("Error in file status: %s", file_status.error)
             return False
             
     except Exception as e:
-        print(f"Error getting initial file status: {str(e)}")
+        logger.error("Error getting initial file status: %s", e)
         return False
     
-    for attempt in range(max_retries):
+    attempt = 0
+    while loop.time() < deadline:
+        attempt += 1
         try:
             # Get fresh file status on each attempt
-            current_status = client.files.get(name=file.name)
+            current_status = await asyncio.to_thread(
+                get_client().files.get, name=file.name
+            )
             file_state = current_status.state
             
-            print(f"\nAttempt {attempt + 1}/{max_retries}")
-            print(f"Current file state: {file_state}")
-            print(f"Time elapsed: {(attempt + 1) * retry_delay} seconds")
+            logger.debug(
+                "Attempt %d: file state %s after %.1f seconds",
+                attempt, file_state, loop.time() - started
+            )
             
             # Check for any error in the current status
             if hasattr(current_status, 'error') and current_status.error:
-                print(f"Error in file status: {current_status.error}")
+                logger.error("Error in file status: %s", current_status.error)
                 return False
             
             if file_state == "ACTIVE":
-                print("✓ File is now ACTIVE and ready for use")
+                logger.info("File is now ACTIVE and ready for use")
                 return True
             elif file_state == "FAILED":
-                print("✗ File processing failed")
-                if hasattr(current_status, 'error'):
-                    print(f"Failure reason: {current_status.error}")
+                logger.error(
+                    "File processing failed: %s",
+                    getattr(current_status, 'error', None)
+                )
                 return False
             elif file_state == "PROCESSING":
-                print("⟳ File is still processing...")
                 # Check if there's any progress information
                 if hasattr(current_status, 'video_metadata'):
-                    print(f"Processing metadata: "
-                          f"{current_status.video_metadata}")
+                    logger.debug("Processing metadata: %s",
+                                 current_status.video_metadata)
             else:
-                print(f"! Unexpected file state: {file_state}")
-            
-            time.sleep(retry_delay)
+                logger.warning("Unexpected file state: %s", file_state)
         except Exception as e:
-            print(f"Error checking file state: {str(e)}")
-            print(f"Error type: {type(e)}")
-            print(f"Error details: {dir(e)}")
-            time.sleep(retry_delay)
+            logger.warning("Error checking file state: %r", e)
+
+        await asyncio.sleep(min(delay, max(deadline - loop.time(), 0)))
+        delay = min(delay * 1.5, FILE_POLL_MAX_DELAY)
     
-    print("\n=== File Processing Timed Out ===")
-    print(f"Total time waited: {max_retries * retry_delay} seconds")
+    logger.error("File processing timed out after %.1f seconds",
+                 loop.time() - started)
     return False
 
-async def run_browser_agent(description):
+async def launch_browser():
+    """Start a browser session that outlives individual agent runs"""
+    # keep_alive stops Agent.run from closing the session it was handed;
+    # no user_data_dir gives each session a throwaway profile
+    browser_session = BrowserSession(
+        browser_profile=BrowserProfile(keep_alive=True, user_data_dir=None)
+    )
+    await browser_session.start()
+    return browser_session
+
+async def _fill_browser_slot():
+    """Launch one session into the pool, retrying until Chromium starts
+
+    While a slot keeps failing it is counted in browser_slots_failing, so
+    health reflects the whole pool rather than the last launch attempt.
+    """
+    global browser_slots_failing, browser_pool_error
+    delay = 1
+    failing = False
+    while not browser_pool_closing:
+        try:
+            browser_session = await launch_browser()
+        except Exception as e:
+            logger.exception("Failed to launch browser session")
+            browser_pool_error = str(e)
+            if not failing:
+                failing = True
+                browser_slots_failing += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BROWSER_RETRY_MAX_DELAY)
+            continue
+        if failing:
+            browser_slots_failing -= 1
+        if browser_pool_closing:
+            await browser_session.kill()
+            return
+        browser_pool.put_nowait(browser_session)
+        return
+
+def _start_browser_task(coro):
+    """Run pool maintenance in the background, keeping a reference"""
+    task = asyncio.create_task(coro)
+    browser_tasks.add(task)
+    task.add_done_callback(browser_tasks.discard)
+
+def browser_pool_down():
+    """True when every pool slot is failing to launch Chromium"""
+    return browser_slots_failing >= get_settings().browser_pool_size
+
+@app.on_event("startup")
+async def configure_executor():
+    # Blocking google-genai calls run via asyncio.to_thread; size the pool
+    # so long generate_content calls cannot starve the status polls
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=BLOCKING_IO_THREADS)
+    )
+
+@app.on_event("startup")
+async def check_settings():
+    # Report missing keys without crashing the worker; /health and the
+    # processing endpoints answer 503 until they are configured
+    if get_settings().google_api_key is None:
+        logger.error("GOOGLE_API_KEY is not set")
+
+@app.on_event("startup")
+async def start_browser_pool():
+    pool_size = get_settings().browser_pool_size
+    logger.info("=== Launching %d Browser Sessions ===", pool_size)
+    # Launches run in the background so a missing Chromium cannot crash
+    # or stall the worker; failed slots keep retrying on their own
+    for _ in range(pool_size):
+        _start_browser_task(_fill_browser_slot())
+
+@app.on_event("shutdown")
+async def stop_browser_pool():
+    global browser_pool_closing
+    # Requests still running release their browsers after this point;
+    # the flag makes those releases kill instead of relaunching
+    browser_pool_closing = True
+    for task in browser_tasks:
+        task.cancel()
+    await asyncio.gather(*browser_tasks, return_exceptions=True)
+    while not browser_pool.empty():
+        await browser_pool.get_nowait().kill()
+
+async def acquire_browser():
+    """Wait for a warm browser session from the pool"""
+    if browser_pool.empty() and browser_pool_down():
+        raise HTTPException(
+            status_code=503,
+            detail=f"Browser unavailable: {browser_pool_error}"
+        )
+    return await browser_pool.get()
+
+async def _recycle_browser(browser_session):
+    """Replace a used session with a freshly launched one"""
+    try:
+        await browser_session.kill()
+    except Exception as e:
+        logger.warning("Error closing browser session: %r", e)
+    if not browser_pool_closing:
+        await _fill_browser_slot()
+
+def release_browser(browser_session):
+    """Give back a session taken by acquire_browser
+
+    Sessions are never reused: the next caller must not inherit this
+    task's cookies or logins, and a crashed Chromium must not poison the
+    slot. The replacement is launched in the background.
+    """
+    _start_browser_task(_recycle_browser(browser_session))
+
+async def run_browser_agent(description, browser_session, on_step_end=None):
     """Run the browser agent with the video description"""
+    # A fresh Agent per task gets its own event bus, so a finished run
+    # cannot leave a shut-down queue behind on the shared session
     agent = Agent(
         task=description,
-        llm=ChatOpenAI(model="gpt-4o")
+        llm=get_llm(),
+        browser_session=browser_session
     )
-    return await agent.run()
+    return await agent.run(on_step_end=on_step_end)
 
-@app.post("/process-video")
-async def process_video(video: UploadFile):
+def _sniff_video_type(head):
+    """Guess a video MIME type from the leading bytes of a file"""
+    if head[4:8] == b"ftyp":
+        return "video/quicktime" if head[8:10] == b"qt" else "video/mp4"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "video/webm"
+    if head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+        return "video/x-msvideo"
+    return None
+
+async def _receive_video(video):
+    """Validate an upload and stream it to a temporary file
+
+    Returns the temporary file path, the sha256 digest of its contents and
+    its video MIME type. The caller owns the file once this returns.
+    """
+    if get_settings().google_api_key is None:
+        raise HTTPException(
+            status_code=503, detail="GOOGLE_API_KEY is not configured"
+        )
+
+    # Reject obviously unusable uploads before copying or sending them on.
+    # curl and requests label file parts application/octet-stream or not
+    # at all, so those fall back to the filename and then the file itself
+    if video.content_type and video.content_type.startswith("video/"):
+        mime_type = video.content_type
+    elif video.content_type in GENERIC_CONTENT_TYPES:
+        mime_type, _ = mimetypes.guess_type(video.filename or "")
+        if not (mime_type or "").startswith("video/"):
+            mime_type = None
+    else:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported content type: {video.content_type}"
+        )
+    if video.size is not None and video.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Video is too large")
+
+    logger.info("=== Starting Video Processing ===")
+    logger.info("Received video: %s (%s)",
+                video.filename, mime_type or video.content_type)
+
+    fd, temp_file_path = tempfile.mkstemp(suffix=".mp4")
+    os.close(fd)
     try:
-        print("\n=== Starting Video Processing ===")
-        print(f"Received video: {video.filename}")
-        print(f"Content type: {video.content_type}")
-        
-        # Create a temporary file to store the uploaded video
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix=".mp4"
-        ) as temp_file:
-            content = await video.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-            print(f"Temporary file created at: {temp_file_path}")
-            print(f"File size: {len(content)} bytes")
-
-        # Upload the video to Gemini
-        try:
-            print("\n=== Uploading to Gemini ===")
-            # Check if the file exists and is readable
-            if not os.path.exists(temp_file_path):
-                raise Exception("Temporary file not found")
-            
-            file_size = os.path.getsize(temp_file_path)
-            print(f"File size before upload: {file_size} bytes")
-            
-            # Upload the file
-            file = client.files.upload(file=temp_file_path)
-            print("File uploaded successfully")
-            print(f"Uploaded file object: {file}")
-            print(f"Uploaded file type: {type(file)}")
-            print(f"Uploaded file attributes: {dir(file)}")
-            
-            # Wait for file to be processed
-            if not wait_for_file_processing(file):
-                raise HTTPException(
-                    status_code=400,
-                    detail="File processing timeout. Please try again."
-                )
-            
-            # Generate content using the video
-            prompt = (
-                "Analyze this video and provide a detailed, step-by-step "
-                "description of all actions performed. Focus on exact "
-                "timestamps, UI elements, and user interactions. Format the "
-                "output as a series of browser automation instructions that "
-                "can be used to replicate these actions. Include specific "
-                "details about elements to click, text to enter, and any "
-                "navigation steps."
-            )
-            print("\n=== Generating Content ===")
-            print("Using model: gemini-2.5-pro-preview-05-06")
-            
+        # Stream the uploaded video to a temporary file in fixed-size
+        # chunks, hashing as we go so the body is never held in memory
+        video_hash = hashlib.sha256()
+        bytes_written = 0
+        async with aiofiles.open(temp_file_path, "wb") as temp_file:
+            while chunk := await video.read(UPLOAD_CHUNK_SIZE):
+                if mime_type is None:
+                    mime_type = _sniff_video_type(chunk)
+                    if mime_type is None:
+                        raise HTTPException(
+                            status_code=400,
+                            detail="Upload does not look like a video"
+                        )
+                bytes_written += len(chunk)
+                if bytes_written > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413, detail="Video is too large"
+                    )
+                video_hash.update(chunk)
+                await temp_file.write(chunk)
+        logger.debug("Wrote %d bytes to %s", bytes_written, temp_file_path)
+        if bytes_written == 0:
+            raise HTTPException(status_code=400, detail="Video is empty")
+    except HTTPException:
+        await aiofiles.os.remove(temp_file_path)
+        raise
+    except Exception as e:
+        await aiofiles.os.remove(temp_file_path)
+        logger.exception("Unexpected error")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return temp_file_path, video_hash.digest(), mime_type
+
+async def _process_events(temp_file_path, video_digest, mime_type):
+    """Run the analyse-and-automate pipeline on a received video
+
+    Yields a ``description`` event as soon as Gemini answers, a ``step``
+    event after each browser agent step and a final ``result`` event.
+    The caller stays responsible for removing the temporary file.
+    """
+    browser_session = None
+    agent_task = None
+    try:
+        # A repeat upload of the exact same bytes reuses the earlier
+        # description; the browser run has side effects and always reruns
+        description_cache = get_description_cache()
+        description_key = description_cache.make_key(
+            video_digest, GEMINI_MODEL, PROMPT_SHA
+        )
+        cached_description = await description_cache.get(description_key)
+        # Entries written before empty answers were filtered count as misses
+        if cached_description and cached_description.get("text"):
+            logger.info("Reusing cached Gemini description for sha256 %s",
+                        video_digest.hex())
+            description = cached_description["text"]
+        else:
+            # Upload the video to Gemini
             try:
-                response = client.models.generate_content(
-                    model="gemini-2.5-pro-preview-05-06",
-                    contents=[file, prompt]
-                )
-                print("Content generated successfully")
+                logger.info("=== Uploading to Gemini ===")
+                # Check if the file exists and is readable
+                if not os.path.exists(temp_file_path):
+                    raise Exception("Temporary file not found")
                 
-                # Clean up the temporary file
-                os.unlink(temp_file_path)
-                print("Temporary file cleaned up")
+                file_size = os.path.getsize(temp_file_path)
+                logger.debug("File size before upload: %d bytes", file_size)
                 
-                # Run the browser agent with the generated description
-                print("\n=== Running Browser Agent ===")
-                browser_result = await run_browser_agent(response.text)
+                # The SDK uploads through Gemini's resumable protocol in
+                # 8 MiB chunks; the async client keeps those chunk
+                # requests off the event loop's critical path
+                file = await get_client().aio.files.upload(
+                    file=temp_file_path,
+                    config=genai.types.UploadFileConfig(
+                        mime_type=mime_type
+                    )
+                )
+                logger.info("File uploaded successfully")
+                logger.debug("Uploaded file object: %s", file)
                 
-                return {
-                    "description": response.text,
-                    "browser_result": browser_result
-                }
+                # Wait for file to be processed
+                if not await wait_for_file_processing(file):
+                    raise HTTPException(
+                        status_code=400,
+                        detail="File processing timeout. Please try again."
+                    )
+                
+            except HTTPException:
+                raise
+            except Exception as e:
+                logger.error("Upload error: %r", e)
+                raise HTTPException(status_code=400, detail=str(e))
+
+            logger.info("=== Generating Content with %s ===", GEMINI_MODEL)
+            
+            try:
+                response = await asyncio.to_thread(
+                    get_client().models.generate_content,
+                    model=GEMINI_MODEL,
+                    contents=[file, PROMPT]
+                )
+                description = response.text
                 
             except Exception as gen_error:
-                print("\n=== Content Generation Error ===")
-                print(f"Error type: {type(gen_error)}")
-                print(f"Error details: {str(gen_error)}")
+                logger.error("Content generation error: %r", gen_error)
                 raise HTTPException(
                     status_code=400,
                     detail=f"Error generating content: {str(gen_error)}"
                 )
+
+            # Blocked responses and ones without text parts have no text;
+            # caching them would replay a useless description for 24h
+            if not description:
+                raise HTTPException(
+                    status_code=502,
+                    detail="Gemini returned an empty description"
+                )
+            logger.info("Content generated successfully")
+            await description_cache.set(
+                description_key, {"text": description}
+            )
+
+        yield {"event": "description", "data": description}
+
+        # Run the browser agent with the generated description, relaying
+        # each finished step; None marks the end of the run
+        logger.info("=== Running Browser Agent ===")
+        browser_session = await acquire_browser()
+        step_events = asyncio.Queue()
+
+        async def on_step_end(agent):
+            step_events.put_nowait({
+                "event": "step",
+                "data": jsonable_encoder({
+                    # n_steps is already advanced when this hook runs
+                    "step": agent.state.n_steps - 1,
+                    "result": agent.state.last_result
+                })
+            })
+
+        async def run_agent():
+            try:
+                return await run_browser_agent(
+                    description, browser_session, on_step_end=on_step_end
+                )
+            finally:
+                step_events.put_nowait(None)
+
+        agent_task = asyncio.create_task(run_agent())
+        while (event := await step_events.get()) is not None:
+            yield event
+        browser_result = await agent_task
+        
+        result = jsonable_encoder({
+            "description": description,
+            "browser_result": browser_result
+        })
+        yield {"event": "result", "data": result}
             
-        except Exception as e:
-            # Clean up the temporary file in case of error
-            os.unlink(temp_file_path)
-            print("\n=== Upload Error ===")
-            print(f"Error type: {type(e)}")
-            print(f"Error details: {str(e)}")
-            raise HTTPException(status_code=400, detail=str(e))
-            
+    except HTTPException:
+        raise
     except Exception as e:
-        print("\n=== Unexpected Error ===")
-        print(f"Error type: {type(e)}")
-        print(f"Error details: {str(e)}")
+        logger.exception("Unexpected error")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # A client disconnect cancels the stream through an anyio cancel
+        # scope that re-fires at every await, so shield the cleanup; the
+        # agent must stop before its browser is given back
+        with anyio.CancelScope(shield=True):
+            if agent_task is not None and not agent_task.done():
+                agent_task.cancel()
+                await asyncio.gather(agent_task, return_exceptions=True)
+            if browser_session is not None:
+                release_browser(browser_session)
+
+async def _remove_upload(temp_file_path):
+    """Delete a file returned by _receive_video, even mid-cancellation"""
+    with anyio.CancelScope(shield=True):
+        await aiofiles.os.remove(temp_file_path)
+    logger.debug("Temporary file cleaned up")
+
+async def _process_one(video):
+    """Run the full pipeline for one uploaded video and return its result"""
+    temp_file_path, video_digest, mime_type = await _receive_video(video)
+    try:
+        result = None
+        async for event in _process_events(
+            temp_file_path, video_digest, mime_type
+        ):
+            if event["event"] == "result":
+                result = event["data"]
+        return result
+    finally:
+        await _remove_upload(temp_file_path)
+
+async def _ndjson_events(events):
+    """Encode pipeline events as newline-delimited JSON"""
+    try:
+        async for event in events:
+            yield orjson.dumps(event) + b"\n"
+    except HTTPException as e:
+        # Headers are already sent, so failures become a final event
+        yield orjson.dumps({"event": "error", "data": e.detail}) + b"\n"
+    finally:
+        await events.aclose()
+
+class UploadStreamingResponse(StreamingResponse):
+    """Streams pipeline events, then removes the upload they came from
+
+    Cleanup lives here rather than in the generators because an async
+    generator that never started does not run its finally block, e.g.
+    when the client is gone before the response begins.
+    """
+
+    def __init__(self, content, temp_file_path, **kwargs):
+        super().__init__(content, **kwargs)
+        self.temp_file_path = temp_file_path
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+            await _remove_upload(self.temp_file_path)
+
+@app.get("/health")
+async def health(settings: Settings = Depends(get_settings)):
+    if settings.google_api_key is None:
+        raise HTTPException(
+            status_code=503, detail="GOOGLE_API_KEY is not configured"
+        )
+    if browser_pool_down():
+        raise HTTPException(
+            status_code=503,
+            detail=f"Browser unavailable: {browser_pool_error}"
+        )
+    return {"status": "ok"}
+
+@app.post("/process-video")
+async def process_video(video: UploadFile):
+    # Receive the upload before streaming so bad input still gets a 4xx
+    temp_file_path, video_digest, mime_type = await _receive_video(video)
+    events = _process_events(temp_file_path, video_digest, mime_type)
+    return UploadStreamingResponse(
+        _ndjson_events(events),
+        temp_file_path=temp_file_path,
+        media_type="application/x-ndjson"
+    )
+
+@app.post("/process-videos-batch")
+async def process_videos_batch(videos: list[UploadFile]):
+    logger.info("=== Starting Batch of %d Videos ===", len(videos))
+    results = await asyncio.gather(
+        *[_process_one(video) for video in videos],
+        return_exceptions=True
+    )
 
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    batch = []
+    for video, result in zip(videos, results):
+        if isinstance(result, HTTPException):
+            batch.append({"filename": video.filename, "error": result.detail})
+        elif isinstance(result, Exception):
+            batch.append({"filename": video.filename, "error": str(result)})
+        else:
+            batch.append({"filename": video.filename, **result})
+    return {"results": batch}